@@ -2,14 +2,34 @@
 import streamlit as st
 import tempfile
 import os
+import numpy as np
 import server
 from server import RAGModel
 
 
+@st.cache_resource
+def load_doc_processor():
+    """Load the embedding model once per process.
+
+    Cached separately from the RAG model so code edits that invalidate
+    init_rag_model don't force reloading ~80MB of encoder weights.
+    """
+    return server.DocumentProcessor()
+
+
+@st.cache_resource
 def init_rag_model():
-    """Initialize the RAG model with API keys."""
+    """Initialize the RAG model with API keys and warm it up."""
     cohere_api_key = st.secrets["COHERE_API_KEY"]
-    return RAGModel(cohere_api_key=cohere_api_key)
+    rag_model = RAGModel(cohere_api_key=cohere_api_key,
+                         doc_processor=load_doc_processor())
+    # Warm up so the first real query doesn't pay for lazy model
+    # initialization or page-faulting the memory-mapped index
+    rag_model.doc_processor.encoder.encode(["warmup"], convert_to_numpy=True)
+    if rag_model.index.index.ntotal > 0:
+        rag_model.index.search(
+            np.zeros(rag_model.index.dimension, dtype='float32'), 1)
+    return rag_model
 
 def main():
     st.title("RAG Based Document Q&A Bot")
@@ -54,16 +74,16 @@ def main():
     if question:
         with st.spinner('Generating answer...'):
             try:
-                response = st.session_state.rag_model.query(question)
-                
-                # Display answer
+                response = st.session_state.rag_model.query_stream(question)
+
+                # Display answer as tokens arrive
                 st.write("### Answer:")
-                st.write(response["answer"])
+                st.write_stream(response["stream"])
                 
                 # Display relevant contexts
                 with st.expander("View relevant contexts"):
                     for i, (context, distance) in enumerate(zip(response["contexts"], response["distances"]), 1):
-                        st.write(f"Context {i} (Distance: {distance:.4f}):")
+                        st.write(f"Context {i} (Similarity: {distance:.4f}):")
                         st.write(context)
                         st.write("---")
             except Exception as e:
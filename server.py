@@ -1,131 +1,660 @@
 # main.py
 import os
+import asyncio
+import atexit
+import hashlib
+import struct
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 import cohere
 import numpy as np
 import faiss
 import pickle
+import torch
 from dotenv import load_dotenv
 from sentence_transformers import SentenceTransformer
-from typing import List, Dict, Any
+from typing import Iterator, List, Dict, Any
 import PyPDF2
 import json
 
-class DocumentProcessor:
+try:
+    # PDFium's C++ backend extracts text 5-10x faster than PyPDF2
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+try:
+    from datasketch import MinHash, MinHashLSH
+except ImportError:
+    MinHash = MinHashLSH = None
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+def _window_bounds(n_tokens: int, window: int, step: int):
+    """Compute (starts, ends) token ranges covering n_tokens.
+
+    Pure numpy (optionally numba-compiled below) so the per-page chunk
+    segmentation does no Python-level loop work.
+    """
+    starts = np.arange(0, n_tokens, step, dtype=np.int64)
+    ends = np.minimum(starts + window, n_tokens)
+    # Stop at the first window that reaches the end; later ones are
+    # redundant tails
+    last = int(np.argmax(ends == n_tokens))
+    return starts[:last + 1], ends[:last + 1]
+
+
+if njit is not None:
+    _window_bounds = njit(cache=True)(_window_bounds)
+
+
+def _extract_page_text(pdf_path: str, page_index: int) -> str:
+    """Extract one page's text.
+
+    Top-level (not a method) so ProcessPoolExecutor can pickle it. Each
+    call reopens the document: cheap, and avoids sharing reader state
+    across workers.
+    """
+    if pdfium is not None:
+        pdf = pdfium.PdfDocument(pdf_path)
+        try:
+            page = pdf[page_index]
+            textpage = page.get_textpage()
+            try:
+                return textpage.get_text_range()
+            finally:
+                textpage.close()
+                page.close()
+        finally:
+            pdf.close()
+    with open(pdf_path, 'rb') as file:
+        return PyPDF2.PdfReader(file).pages[page_index].extract_text()
+
+# Use all cores for CPU inference (PyTorch defaults can leave cores idle)
+torch.set_num_threads(os.cpu_count())
+
+class ONNXEncoder:
+    """MiniLM encoder running on ONNX Runtime (3-4x faster on CPU).
+
+    Drop-in for the subset of SentenceTransformer.encode this app uses:
+    tokenize, run the ORT session, mean-pool over the attention mask,
+    optionally L2-normalize, return numpy float32.
+    """
+
+    MODEL_NAME = 'sentence-transformers/all-MiniLM-L6-v2'
+    CACHE_DIR = 'data/onnx_minilm'
+
     def __init__(self):
-        self.encoder = SentenceTransformer('all-MiniLM-L6-v2')
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from transformers import AutoTokenizer
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = \
+            ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        if os.path.isdir(self.CACHE_DIR):
+            # Reuse the previously exported model
+            self.model = ORTModelForFeatureExtraction.from_pretrained(
+                self.CACHE_DIR, session_options=options,
+                provider='CPUExecutionProvider')
+            self.tokenizer = AutoTokenizer.from_pretrained(self.CACHE_DIR)
+        else:
+            self.model = ORTModelForFeatureExtraction.from_pretrained(
+                self.MODEL_NAME, export=True, session_options=options,
+                provider='CPUExecutionProvider')
+            self.tokenizer = AutoTokenizer.from_pretrained(self.MODEL_NAME)
+            # Cache the export so later startups skip the conversion
+            self.model.save_pretrained(self.CACHE_DIR)
+            self.tokenizer.save_pretrained(self.CACHE_DIR)
+
+    def encode(self, sentences: List[str], batch_size: int = 64,
+               convert_to_numpy: bool = True,
+               normalize_embeddings: bool = False,
+               show_progress_bar: bool = False) -> np.ndarray:
+        """Encode sentences to embeddings (numpy float32)."""
+        embeddings = []
+        for start in range(0, len(sentences), batch_size):
+            batch = sentences[start:start + batch_size]
+            inputs = self.tokenizer(batch, padding='longest', truncation=True,
+                                    max_length=256, return_tensors='np')
+            hidden = self.model(**inputs).last_hidden_state
+            # Mean-pool over real (non-padding) tokens only
+            mask = inputs['attention_mask'][..., np.newaxis].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            embeddings.append(pooled)
+        result = np.vstack(embeddings).astype(np.float32)
+        if normalize_embeddings:
+            result /= np.maximum(np.linalg.norm(result, axis=1, keepdims=True), 1e-12)
+        return result
+
+
+class ChunkDeduplicator:
+    """Filters near-duplicate chunks before they reach the index.
+
+    PDFs repeat headers, footers and boilerplate on every page; indexing
+    each copy wastes encoding time and lets duplicates crowd the top-k.
+    Uses MinHash LSH over 5-word shingles when datasketch is installed,
+    otherwise falls back to exact-match hashing.
+    """
+
+    NUM_PERM = 128
+    SHINGLE = 5
+
+    def __init__(self, threshold: float = 0.9):
+        self._lsh = MinHashLSH(threshold=threshold, num_perm=self.NUM_PERM) \
+            if MinHashLSH is not None else None
+        self._seen = set()
+        self._count = 0
+
+    def is_duplicate(self, chunk: str) -> bool:
+        """Return True if chunk near-duplicates one already kept."""
+        if self._lsh is None:
+            key = hashlib.blake2b(chunk.encode()).digest()
+            if key in self._seen:
+                return True
+            self._seen.add(key)
+            return False
+
+        words = chunk.split()
+        minhash = MinHash(num_perm=self.NUM_PERM)
+        for i in range(max(1, len(words) - self.SHINGLE + 1)):
+            minhash.update(' '.join(words[i:i + self.SHINGLE]).encode())
+        if self._lsh.query(minhash):
+            return True
+        self._lsh.insert(f'chunk-{self._count}', minhash)
+        self._count += 1
+        return False
+
+
+class DocumentProcessor:
+    def __init__(self, use_onnx: bool = True, quantize: bool = False,
+                 encoder=None):
+        # An already-loaded encoder can be injected (e.g. one shared via
+        # st.cache_resource across Streamlit sessions)
+        self.encoder = encoder
+        if self.encoder is not None:
+            return
+        if use_onnx:
+            try:
+                self.encoder = ONNXEncoder()
+            except ImportError:
+                # optimum/onnxruntime not installed; use the PyTorch path
+                pass
+        if self.encoder is None:
+            self.encoder = SentenceTransformer('all-MiniLM-L6-v2')
+            if quantize:
+                # int8 dynamic quantization of the Linear layers roughly
+                # halves encoding time on CPUs with VNNI; embeddings are
+                # still returned as float32. Not applicable to the ONNX
+                # path, which has its own optimized kernels.
+                self.encoder[0].auto_model = torch.quantization.quantize_dynamic(
+                    self.encoder[0].auto_model, {torch.nn.Linear},
+                    dtype=torch.qint8)
     
+    def iter_chunks(self, pdf_file: str) -> Iterator[str]:
+        """Extract text from PDF and yield chunks page by page.
+
+        Streaming keeps peak memory at one page of text plus one encoding
+        batch, instead of the whole document's chunk list.
+        """
+        for text in self._iter_page_texts(pdf_file):
+            yield from self._chunk_text(text)
+
+    def _iter_page_texts(self, pdf_file: str) -> Iterator[str]:
+        """Yield each page's text, extracting pages across CPU cores.
+
+        PDFium releases the GIL so threads suffice; PyPDF2's parsing is
+        pure Python and needs processes to actually run in parallel.
+        """
+        if pdfium is not None:
+            pdf = pdfium.PdfDocument(pdf_file)
+            try:
+                num_pages = len(pdf)
+            finally:
+                pdf.close()
+            executor_cls = ThreadPoolExecutor
+        else:
+            with open(pdf_file, 'rb') as file:
+                num_pages = len(PyPDF2.PdfReader(file).pages)
+            executor_cls = ProcessPoolExecutor
+
+        with executor_cls(max_workers=os.cpu_count()) as executor:
+            # map preserves page order
+            yield from executor.map(partial(_extract_page_text, pdf_file),
+                                    range(num_pages))
+
+    # Window sizes in tokens; overlap keeps concepts that straddle a
+    # boundary retrievable from at least one chunk
+    CHUNK_TOKENS = 256
+    CHUNK_OVERLAP = 32
+
+    def _chunk_text(self, text: str) -> Iterator[str]:
+        """Split a page's text into overlapping token-budgeted chunks.
+
+        Tokenizes once per page and slices the original text by character
+        offsets, so chunks line up with what the encoder actually sees
+        (MiniLM truncates at 256 tokens anyway).
+        """
+        text = text.strip()
+        if not text:
+            return
+        offsets = self.encoder.tokenizer(
+            text, add_special_tokens=False,
+            return_offsets_mapping=True)['offset_mapping']
+        if len(offsets) <= self.CHUNK_TOKENS:
+            yield text
+            return
+        step = self.CHUNK_TOKENS - self.CHUNK_OVERLAP
+        starts, ends = _window_bounds(len(offsets), self.CHUNK_TOKENS, step)
+        for start, end in zip(starts, ends):
+            chunk = text[offsets[start][0]:offsets[end - 1][1]].strip()
+            if chunk:
+                yield chunk
+
     def process_pdf(self, pdf_file: str) -> List[str]:
         """Extract text from PDF and split into chunks."""
-        chunks = []
-        with open(pdf_file, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            for page in pdf_reader.pages:
-                text = page.extract_text()
-                # Split into smaller chunks (you can adjust the chunk size)
-                paragraphs = [p.strip() for p in text.split('\n\n') if p.strip()]
-                for paragraph in paragraphs:
-                    # Further split long paragraphs if needed
-                    if len(paragraph) > 512:
-                        words = paragraph.split()
-                        for i in range(0, len(words), 100):
-                            chunk = ' '.join(words[i:i + 100])
-                            if chunk:
-                                chunks.append(chunk)
-                    else:
-                        chunks.append(paragraph)
-        return chunks
+        return list(self.iter_chunks(pdf_file))
 
     def create_embeddings(self, chunks: List[str]) -> np.ndarray:
-        """Create embeddings for text chunks."""
-        return self.encoder.encode(chunks, convert_to_numpy=True)
+        """Create L2-normalized embeddings for text chunks."""
+        # Normalized vectors make cosine similarity == inner product,
+        # which is what the IP index below expects. A large batch keeps the
+        # CPU saturated; sentence-transformers length-sorts each batch
+        # internally (and restores order), minimizing padding waste.
+        embeddings = self.encoder.encode(chunks, batch_size=64,
+                                         convert_to_numpy=True,
+                                         normalize_embeddings=True,
+                                         show_progress_bar=False)
+        # FAISS wants contiguous float32; converting here avoids a silent
+        # copy inside its SWIG layer on every add
+        return np.ascontiguousarray(embeddings, dtype=np.float32)
+
+class ChunkStore:
+    """Append-only binary chunk store with O(1) random access.
+
+    The .bin file holds (uint32 length, utf8 bytes) records and the .idx
+    file is a flat uint64 array of record offsets, memory-mapped on open.
+    Reading chunk i is one seek plus two reads, so chunk texts never have
+    to be held in RAM, and JSON parse/escape overhead is gone entirely.
+    """
+
+    def __init__(self, bin_file: str, idx_file: str):
+        self.bin_file = bin_file
+        self.idx_file = idx_file
+        self._reader = None
+        self._offsets = None
+        self._refresh()
+
+    def _refresh(self):
+        """(Re)open the offset memmap and data file after appends."""
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+        if os.path.exists(self.idx_file) and os.path.getsize(self.idx_file):
+            self._offsets = np.memmap(self.idx_file, dtype=np.uint64, mode='r')
+            self._reader = open(self.bin_file, 'rb')
+        else:
+            self._offsets = np.empty(0, dtype=np.uint64)
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def __getitem__(self, i) -> str:
+        self._reader.seek(int(self._offsets[i]))
+        (length,) = struct.unpack('<I', self._reader.read(4))
+        return self._reader.read(length).decode('utf-8')
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def extend(self, chunks: List[str]):
+        """Append chunks to the store (list.extend-compatible)."""
+        with open(self.bin_file, 'ab') as bf, open(self.idx_file, 'ab') as xf:
+            for chunk in chunks:
+                data = chunk.encode('utf-8')
+                xf.write(struct.pack('<Q', bf.tell()))
+                bf.write(struct.pack('<I', len(data)))
+                bf.write(data)
+        self._refresh()
+
+    def clear(self):
+        """Delete the store's files and reset to empty."""
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+        for path in (self.bin_file, self.idx_file):
+            if os.path.exists(path):
+                os.remove(path)
+        self._refresh()
+
 
 class FAISSIndex:
-    def __init__(self, dimension: int = 384):
-        """Initialize FAISS index."""
+    # Candidates fetched from the compressed graph per requested result;
+    # with k=3 that's ~100 candidates reranked exactly
+    K_FACTOR = 32
+
+    def __init__(self, dimension: int = 384, ef_search: int = 64,
+                 chunk_store: ChunkStore = None):
+        """Initialize FAISS index (HNSW graph for sub-linear query time)."""
         self.dimension = dimension
-        self.index = faiss.IndexFlatL2(dimension)
-        self.chunks = []
-        
+        self.ef_search = ef_search
+        # 32 neighbors per node; higher efConstruction = better graph quality.
+        # Inner product over L2-normalized embeddings == cosine similarity.
+        # The graph traversal (the hot loop) reads only fp16 vectors, at
+        # half the bandwidth of flat float32.
+        base = faiss.IndexHNSWSQ(
+            dimension, faiss.ScalarQuantizer.QT_fp16, 32,
+            faiss.METRIC_INNER_PRODUCT)
+        base.hnsw.efConstruction = 200
+        # Exact rerank of the graph's top candidates recovers flat-index
+        # accuracy. Note the refine stage keeps a full float32 copy in
+        # RAM (total 6B/dim vs 4B/dim for plain IndexHNSWFlat) — a
+        # deliberate memory-for-accuracy trade; only ~k*K_FACTOR of those
+        # fp32 vectors are touched per query, so they stay out of cache.
+        self.index = faiss.IndexRefineFlat(base)
+        # A ChunkStore persists appends itself; a plain list is fine for
+        # throwaway in-memory use
+        self.chunks = chunk_store if chunk_store is not None else []
+        self._mmap = False
+        self._index_file = None
+
+    def add_embeddings(self, vectors: np.ndarray):
+        """Add vectors whose chunks are already in the store."""
+        if self._mmap:
+            # A memory-mapped index is read-only; reload it into RAM
+            # before the first mutation
+            self.index = faiss.read_index(self._index_file)
+            self._mmap = False
+        if not self.index.is_trained:
+            # QT_fp16 is data-independent but FAISS still wants train()
+            self.index.train(vectors)
+        self.index.add(vectors)
+
     def add_vectors(self, vectors: np.ndarray, chunks: List[str]):
         """Add vectors and their corresponding text chunks to the index."""
-        self.index.add(vectors)
+        self.add_embeddings(vectors)
         self.chunks.extend(chunks)
-    
+
+    def is_compatible(self) -> bool:
+        """True if the loaded index matches the refine-over-HNSW layout.
+
+        Indexes persisted by older versions (e.g. the original flat L2
+        index) deserialize fine but lack the refine/HNSW structure search
+        relies on, and their vectors predate L2 normalization.
+        """
+        index = faiss.downcast_index(self.index)
+        if not isinstance(index, faiss.IndexRefineFlat):
+            return False
+        return hasattr(faiss.downcast_index(index.base_index), 'hnsw')
+
     def search(self, query_vector: np.ndarray, k: int = 3) -> tuple:
-        """Search for similar vectors and return their distances and indices."""
+        """Search for similar vectors and return their distances and indices.
+
+        The graph returns k * K_FACTOR coarse candidates, which the
+        refine stage reranks with exact float32 inner products before
+        returning the top k.
+        """
+        # Downcast transiently: self.index must keep holding the owning
+        # proxy, since downcast_index returns a non-owning view and
+        # rebinding would free the C++ index under us
+        refine = faiss.downcast_index(self.index)
+        refine.k_factor = self.K_FACTOR
+        base = faiss.downcast_index(refine.base_index)
+        base.hnsw.efSearch = max(self.ef_search, k * self.K_FACTOR)
         return self.index.search(query_vector.reshape(1, -1), k)
     
-    def save(self, index_file: str, chunks_file: str):
-        """Save the FAISS index and chunks to disk."""
+    def save(self, index_file: str):
+        """Write the FAISS index to disk (chunks persist via ChunkStore)."""
         faiss.write_index(self.index, index_file)
-        with open(chunks_file, 'w', encoding='utf-8') as f:
-            json.dump(self.chunks, f)
-    
-    def load(self, index_file: str, chunks_file: str):
-        """Load the FAISS index and chunks from disk."""
-        self.index = faiss.read_index(index_file)
-        with open(chunks_file, 'r', encoding='utf-8') as f:
-            self.chunks = json.load(f)
+
+    def load(self, index_file: str):
+        """Load the FAISS index from disk.
+
+        The index is memory-mapped where FAISS supports it, so cold start
+        pays for page-faulting only what searches touch instead of
+        reading the whole file into RAM up front.
+        """
+        self._index_file = index_file
+        try:
+            self.index = faiss.read_index(
+                index_file, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            self._mmap = True
+        except RuntimeError:
+            # Not all index types support mmap'd reads
+            self.index = faiss.read_index(index_file)
+            self._mmap = False
 
 class RAGModel:
-    def __init__(self, cohere_api_key: str):
+    def __init__(self, cohere_api_key: str, doc_processor: DocumentProcessor = None):
         load_dotenv()
-        
-        # Initialize FAISS index
-        self.index = FAISSIndex()
-        
-        # Initialize Cohere client
+
+        # Initialize Cohere client (async clients are created per event
+        # loop by aquery/query_batch)
         self.co = cohere.Client(cohere_api_key)
-        
-        # Initialize document processor
-        self.doc_processor = DocumentProcessor()
+        self._cohere_api_key = cohere_api_key
+
+        # Initialize document processor (or reuse a shared one)
+        self.doc_processor = doc_processor if doc_processor is not None \
+            else DocumentProcessor()
+
+        # LRU cache of question -> embedding; repeats skip a forward pass
+        self._q_cache: OrderedDict = OrderedDict()
+        self._q_cache_size = 1024
+
+        # LRU cache of prompt -> answer; identical prompts skip the
+        # Cohere call (the slowest and only billed step)
+        self._answer_cache: OrderedDict = OrderedDict()
+        self._answer_cache_size = 512
+        self.answer_cache_file = 'data/answer_cache.json'
+        self._load_answer_cache()
+        atexit.register(self._save_answer_cache)
         
         # Create data directory if it doesn't exist
         os.makedirs('data', exist_ok=True)
         self.index_file = 'data/faiss.index'
-        self.chunks_file = 'data/chunks.json'
-        
-        # Load existing index if available
-        if os.path.exists(self.index_file) and os.path.exists(self.chunks_file):
-            self.index.load(self.index_file, self.chunks_file)
+        self.chunk_store = ChunkStore('data/chunks.bin', 'data/chunks.idx')
+        self._migrate_legacy_chunks()
+
+        # Initialize FAISS index, backed by the on-disk chunk store
+        self.index = FAISSIndex(chunk_store=self.chunk_store)
+
+        # The index is kept in memory and written back lazily: at most
+        # once per SAVE_INTERVAL and on interpreter exit
+        self._index_dirty = False
+        self._last_index_save = 0.0
+        atexit.register(self.flush_index)
+
+        # Load existing index if available; one persisted by an older
+        # version (flat L2, unnormalized vectors) gets rebuilt from the
+        # chunk store, mirroring _migrate_legacy_chunks
+        if os.path.exists(self.index_file):
+            self.index.load(self.index_file)
+            if not self.index.is_compatible():
+                self._rebuild_index()
+
+        # The deduplicator is seeded lazily by the first index_document;
+        # seeding replays the whole chunk store through MinHash, which
+        # queries shouldn't pay for at cold start
+        self._dedup = None
     
+    ENCODE_BATCH = 256
+    SAVE_INTERVAL = 60.0  # seconds between full index rewrites
+
+    def _migrate_legacy_chunks(self):
+        """Convert old JSON/JSONL chunk files into the binary store."""
+        if len(self.chunk_store):
+            return
+        if os.path.exists('data/chunks.jsonl'):
+            with open('data/chunks.jsonl', 'r', encoding='utf-8') as f:
+                self.chunk_store.extend(
+                    [json.loads(line) for line in f if line.strip()])
+            os.remove('data/chunks.jsonl')
+        elif os.path.exists('data/chunks.json'):
+            with open('data/chunks.json', 'r', encoding='utf-8') as f:
+                self.chunk_store.extend(json.load(f))
+            os.remove('data/chunks.json')
+
+    def _get_dedup(self) -> ChunkDeduplicator:
+        """Build the deduplicator on first use, seeded from the store.
+
+        Seeding existing chunks makes uploads of overlapping documents
+        skip shared boilerplate; deferring it keeps query-only cold
+        starts O(1) in corpus size.
+        """
+        if self._dedup is None:
+            self._dedup = ChunkDeduplicator()
+            for chunk in self.chunk_store:
+                self._dedup.is_duplicate(chunk)
+        return self._dedup
+
+    def _rebuild_index(self):
+        """Re-embed the chunk store into a fresh index.
+
+        The chunks on disk are the source of truth; embedding them again
+        with the current (normalized) pipeline replaces a stale index in
+        one pass, batched like index_document.
+        """
+        self.index = FAISSIndex(chunk_store=self.chunk_store)
+        batch: List[str] = []
+        for chunk in self.chunk_store:
+            batch.append(chunk)
+            if len(batch) >= self.ENCODE_BATCH:
+                self.index.add_embeddings(
+                    self.doc_processor.create_embeddings(batch))
+                batch.clear()
+        if batch:
+            self.index.add_embeddings(
+                self.doc_processor.create_embeddings(batch))
+        self._index_dirty = True
+        self.flush_index()
+
+    def flush_index(self):
+        """Write the FAISS index to disk if it has unsaved additions."""
+        if self._index_dirty:
+            self.index.save(self.index_file)
+            self._index_dirty = False
+            self._last_index_save = time.time()
+
     def index_document(self, pdf_path: str) -> int:
-        """Process and index a document."""
-        # Process PDF into chunks
-        chunks = self.doc_processor.process_pdf(pdf_path)
-        
-        # Create embeddings
-        embeddings = self.doc_processor.create_embeddings(chunks)
-        
-        # Add to FAISS index
-        self.index.add_vectors(embeddings, chunks)
-        
-        # Save the updated index
-        self.index.save(self.index_file, self.chunks_file)
-        
-        return len(chunks)
+        """Process and index a document, streaming chunks in batches."""
+        num_chunks = 0
+        batch: List[str] = []
+
+        def flush():
+            nonlocal num_chunks
+            if batch:
+                embeddings = self.doc_processor.create_embeddings(batch)
+                # The chunk store persists each append itself: O(batch) IO
+                self.index.add_vectors(embeddings, batch)
+                num_chunks += len(batch)
+                batch.clear()
+
+        dedup = self._get_dedup()
+        for chunk in self.doc_processor.iter_chunks(pdf_path):
+            if dedup.is_duplicate(chunk):
+                continue
+            batch.append(chunk)
+            if len(batch) >= self.ENCODE_BATCH:
+                flush()
+        flush()
+
+        # Rewriting the whole FAISS index is O(N) IO, so coalesce writes
+        self._index_dirty = True
+        if time.time() - self._last_index_save > self.SAVE_INTERVAL:
+            self.flush_index()
+
+        return num_chunks
     
-    def query(self, question: str, top_k: int = 3) -> Dict[str, Any]:
-        """Query the RAG model with a question."""
-        # Create query embedding
-        query_embedding = self.doc_processor.encoder.encode([question])[0]
-        
-        # Query FAISS index
-        distances, indices = self.index.search(query_embedding, top_k)
-        
-        # Get relevant contexts
-        contexts = [self.index.chunks[idx] for idx in indices[0]]
-        
-        # Generate answer using Cohere
-        prompt = f"""Based on the following contexts, answer the question.
-        
+    def _embed_question(self, question: str) -> np.ndarray:
+        """Embed a question, reusing a cached vector for repeats."""
+        key = hashlib.blake2b(question.encode()).hexdigest()
+        if key in self._q_cache:
+            self._q_cache.move_to_end(key)
+            return self._q_cache[key]
+        embedding = np.ascontiguousarray(
+            self.doc_processor.encoder.encode(
+                [question], convert_to_numpy=True,
+                normalize_embeddings=True)[0],
+            dtype=np.float32)
+        self._q_cache[key] = embedding
+        if len(self._q_cache) > self._q_cache_size:
+            self._q_cache.popitem(last=False)
+        return embedding
+
+    def _load_answer_cache(self):
+        """Load the persisted answer cache, if any."""
+        if os.path.exists(self.answer_cache_file):
+            try:
+                with open(self.answer_cache_file, 'r', encoding='utf-8') as f:
+                    self._answer_cache = OrderedDict(json.load(f))
+            except (json.JSONDecodeError, OSError):
+                self._answer_cache = OrderedDict()
+
+    def _save_answer_cache(self):
+        """Persist the answer cache to disk (registered with atexit)."""
+        try:
+            with open(self.answer_cache_file, 'w', encoding='utf-8') as f:
+                json.dump(list(self._answer_cache.items()), f)
+        except OSError:
+            pass
+
+    def _build_prompt(self, question: str, contexts: List[str]) -> str:
+        """Assemble the generation prompt from retrieved contexts."""
+        return f"""Based on the following contexts, answer the question.
+
 Contexts:
 {' '.join(contexts)}
 
 Question: {question}
 
 Answer:"""
-        
+
+    def _cache_answer(self, key: str, answer: str):
+        """Insert an answer into the LRU cache."""
+        self._answer_cache[key] = {'answer': answer, 'timestamp': time.time()}
+        if len(self._answer_cache) > self._answer_cache_size:
+            self._answer_cache.popitem(last=False)
+
+    def _stream_answer(self, prompt: str) -> Iterator[str]:
+        """Yield answer tokens as Cohere produces them.
+
+        Perceived latency drops from full-generation time to
+        time-to-first-token. The assembled answer still lands in the
+        prompt cache, and cache hits yield immediately.
+        """
+        key = hashlib.blake2b(prompt.encode()).hexdigest()
+        if key in self._answer_cache:
+            self._answer_cache.move_to_end(key)
+            yield self._answer_cache[key]['answer']
+            return
+
+        pieces = []
+        for token in self.co.generate(
+                prompt=prompt,
+                max_tokens=300,
+                temperature=0.7,
+                k=0,
+                stop_sequences=[],
+                stream=True):
+            pieces.append(token.text)
+            yield token.text
+        self._cache_answer(key, ''.join(pieces).strip())
+
+    def _generate_answer(self, prompt: str) -> str:
+        """Generate an answer with Cohere, caching by prompt hash."""
+        key = hashlib.blake2b(prompt.encode()).hexdigest()
+        if key in self._answer_cache:
+            self._answer_cache.move_to_end(key)
+            return self._answer_cache[key]['answer']
+
         response = self.co.generate(
             prompt=prompt,
             max_tokens=300,
@@ -134,20 +663,97 @@ Answer:"""
             stop_sequences=[],
             return_likelihoods='NONE'
         )
-        
+        answer = response.generations[0].text.strip()
+        self._cache_answer(key, answer)
+        return answer
+
+    def _retrieve(self, question: str, top_k: int):
+        """Embed the question and fetch the top-k contexts."""
+        query_embedding = self._embed_question(question)
+        distances, indices = self.index.search(query_embedding, top_k)
+        contexts = [self.index.chunks[idx] for idx in indices[0]]
+        return contexts, distances[0].tolist()
+
+    def query(self, question: str, top_k: int = 3) -> Dict[str, Any]:
+        """Query the RAG model with a question."""
+        contexts, distances = self._retrieve(question, top_k)
+        return {
+            "answer": self._generate_answer(self._build_prompt(question, contexts)),
+            "contexts": contexts,
+            "distances": distances
+        }
+
+    def query_stream(self, question: str, top_k: int = 3) -> Dict[str, Any]:
+        """Like query, but "stream" is a generator of answer tokens."""
+        contexts, distances = self._retrieve(question, top_k)
         return {
-            "answer": response.generations[0].text.strip(),
+            "stream": self._stream_answer(self._build_prompt(question, contexts)),
             "contexts": contexts,
-            "distances": distances[0].tolist()
+            "distances": distances
         }
 
+    async def aquery(self, question: str, top_k: int = 3,
+                     client: 'cohere.AsyncClient' = None) -> Dict[str, Any]:
+        """Async version of query; generation awaits instead of blocking.
+
+        Retrieval is local and fast, so only the Cohere call is awaited;
+        concurrent aquery calls overlap their network round-trips. The
+        client's aiohttp session is bound to the event loop it first runs
+        on, so callers gathering several queries should pass one client;
+        otherwise a short-lived client is created and closed here.
+        """
+        contexts, distances = self._retrieve(question, top_k)
+        prompt = self._build_prompt(question, contexts)
+
+        key = hashlib.blake2b(prompt.encode()).hexdigest()
+        if key in self._answer_cache:
+            self._answer_cache.move_to_end(key)
+            answer = self._answer_cache[key]['answer']
+        else:
+            owns_client = client is None
+            if owns_client:
+                client = cohere.AsyncClient(self._cohere_api_key)
+            try:
+                response = await client.generate(
+                    prompt=prompt,
+                    max_tokens=300,
+                    temperature=0.7,
+                    k=0,
+                    stop_sequences=[],
+                    return_likelihoods='NONE'
+                )
+            finally:
+                if owns_client:
+                    await client.close()
+            answer = response.generations[0].text.strip()
+            self._cache_answer(key, answer)
+
+        return {
+            "answer": answer,
+            "contexts": contexts,
+            "distances": distances
+        }
+
+    def query_batch(self, questions: List[str], top_k: int = 3) -> List[Dict[str, Any]]:
+        """Answer several questions with their Cohere calls in flight at once."""
+        async def run():
+            client = cohere.AsyncClient(self._cohere_api_key)
+            try:
+                return await asyncio.gather(
+                    *(self.aquery(question, top_k, client=client)
+                      for question in questions))
+            finally:
+                await client.close()
+        return asyncio.run(run())
+
     def clear_index(self):
         """Clear the current index and saved files."""
-        self.index = FAISSIndex()
+        self.chunk_store.clear()
+        self.index = FAISSIndex(chunk_store=self.chunk_store)
+        self._dedup = None
+        self._index_dirty = False
         if os.path.exists(self.index_file):
             os.remove(self.index_file)
-        if os.path.exists(self.chunks_file):
-            os.remove(self.chunks_file)
 
 # Usage example:
 if __name__ == "__main__":